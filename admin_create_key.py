@@ -1,14 +1,17 @@
+import asyncio
 import secrets
 import hashlib
 import sys
-from database import SessionLocal, engine, Base
+from database import AsyncSessionLocal, engine
 from models import ApiKeyDB
 
-# Ensure tables exist
-Base.metadata.create_all(bind=engine)
 
+async def create_api_key(user_name, user_id):
+    # Ensure the keys table exists; the rest of the schema (and its indexes
+    # on the live telemetry table) is init_db.py's job
+    async with engine.begin() as conn:
+        await conn.run_sync(ApiKeyDB.__table__.create, checkfirst=True)
 
-def create_api_key(user_name, user_id):
     # 1. Generate a secure random key
     # Format: sk_live_<24_random_hex_chars>
     raw_key = f"sk_live_{secrets.token_hex(12)}"
@@ -18,30 +21,30 @@ def create_api_key(user_name, user_id):
     hashed_key = hashlib.sha256(raw_key.encode()).hexdigest()
 
     # 3. Store in DB
-    db = SessionLocal()
-    try:
-        new_key = ApiKeyDB(
-            key_hash=hashed_key,
-            user_id=user_id,
-            owner_name=user_name
-        )
-        db.add(new_key)
-        db.commit()
-
-        print("\n" + "="*50)
-        print(f"✅ Key Created for {user_name}")
-        print(f"🔑 API KEY: {raw_key}")
-        print("⚠️  COPY THIS NOW. It will never be shown again.")
-        print("="*50 + "\n")
-
-    except Exception as e:
-        print(f"❌ Error: {e}")
-    finally:
-        db.close()
+    async with AsyncSessionLocal() as db:
+        try:
+            new_key = ApiKeyDB(
+                key_hash=hashed_key,
+                user_id=user_id,
+                owner_name=user_name
+            )
+            db.add(new_key)
+            await db.commit()
+
+            print("\n" + "="*50)
+            print(f"✅ Key Created for {user_name}")
+            print(f"🔑 API KEY: {raw_key}")
+            print("⚠️  COPY THIS NOW. It will never be shown again.")
+            print("="*50 + "\n")
+
+        except Exception as e:
+            print(f"❌ Error: {e}")
+
+    await engine.dispose()
 
 
 if __name__ == "__main__":
     if len(sys.argv) < 3:
         print("Usage: python admin_create_key.py <Name> <UserID>")
     else:
-        create_api_key(sys.argv[1], sys.argv[2])
+        asyncio.run(create_api_key(sys.argv[1], sys.argv[2]))
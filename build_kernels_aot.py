@@ -0,0 +1,22 @@
+from numba.pycc import CC
+from main import hurst_kernel, score_brokers
+
+# Compiles the numba kernels ahead of time into the kernels_aot extension
+# module, which main.py picks up when importable (falling back to the JIT).
+# Run as a build step on the deploy platform; the .so is not portable:
+#   python build_kernels_aot.py
+
+def py_func(fn):
+    # main.py leaves the kernels undecorated once a kernels_aot build exists
+    return getattr(fn, "py_func", fn)
+
+
+cc = CC("kernels_aot")
+cc.export("hurst", "f8(f8[:])")(py_func(hurst_kernel))
+cc.export("score_brokers",
+          "Tuple((f8[:], i8[:]))(f8[:], f8[:], f8[:], f8[:], b1)")(py_func(score_brokers))
+
+
+if __name__ == "__main__":
+    cc.compile()
+    print("✅ Built kernels_aot")
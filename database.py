@@ -1,24 +1,63 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
 
 # 1. Get the DB URL from Environment Variables (Vercel injects this)
 # If not found, fallback to local SQLite (for your laptop)
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./pnl.db")
 
-# 2. Fix for Postgres URL (SQLAlchemy needs 'postgresql://', Neon gives 'postgres://')
+# 2. Pick the async driver (Neon gives 'postgres://', SQLAlchemy needs a dialect+driver)
 if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
     SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace(
         "postgres://", "postgresql://", 1)
+if SQLALCHEMY_DATABASE_URL.startswith("postgresql://"):
+    SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace(
+        "postgresql://", "postgresql+asyncpg://", 1)
+elif SQLALCHEMY_DATABASE_URL.startswith("sqlite://"):
+    SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace(
+        "sqlite://", "sqlite+aiosqlite://", 1)
 
 # 3. Create Engine
 if "sqlite" in SQLALCHEMY_DATABASE_URL:
-    engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={
-                           "check_same_thread": False})
+    engine = create_async_engine(SQLALCHEMY_DATABASE_URL, connect_args={
+                                 "check_same_thread": False})
+
+    # WAL lets readers run alongside the telemetry writer; NORMAL sync skips
+    # the per-commit fsync that is only needed for power-loss durability.
+    @event.listens_for(engine.sync_engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, _):
+        cur = dbapi_conn.cursor()
+        cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute("PRAGMA busy_timeout=5000")
+        cur.execute("PRAGMA temp_store=MEMORY")
+        cur.execute("PRAGMA mmap_size=268435456")
+        cur.close()
 else:
-    # Postgres (Neon) doesn't need 'check_same_thread'
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    # asyncpg doesn't understand libpq query params like ?sslmode=require;
+    # its ssl argument takes the same modes (disable, prefer, require, ...).
+    # Neon needs TLS, so require it unless the URL says otherwise.
+    url = make_url(SQLALCHEMY_DATABASE_URL)
+    sslmode = url.query.get("sslmode", "require")
+    url = url.difference_update_query(["sslmode", "channel_binding"])
+
+    # Neon drops idle connections aggressively: keep a warm pool, ping before
+    # checkout and recycle before the server side times the connection out.
+    engine = create_async_engine(
+        url,
+        pool_size=20,
+        max_overflow=20,
+        pool_timeout=30,
+        pool_pre_ping=True,
+        pool_recycle=1800,
+        connect_args={
+            "ssl": sslmode,
+            "server_settings": {"statement_timeout": "5000"},
+        },
+    )
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
@@ -0,0 +1,29 @@
+import asyncio
+from database import engine, Base
+from models import create_indexes
+
+# One-shot schema setup (tables + indexes). Run once per deploy:
+#   python init_db.py
+# The API only does this itself on the local SQLite fallback or when
+# APP_INIT_DB=1, so worker cold starts skip the metadata round-trips.
+
+
+async def create_schema():
+    # Autocommit: Postgres refuses CREATE/DROP INDEX CONCURRENTLY inside a
+    # transaction block. Every step checks first, so a rerun picks up where
+    # a failed one stopped (except that a failed concurrent build leaves an
+    # INVALID index behind, which has to be dropped by hand first).
+    async with engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(create_indexes)
+
+
+async def main():
+    await create_schema()
+    await engine.dispose()
+    print("✅ Schema ready")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,24 +1,83 @@
+import asyncio
+import base64
+import contextlib
+import gzip
 import logging
-import statistics
 import math
+import os
+import secrets
+import time
+from collections import defaultdict, deque
+import asyncpg
+import brotli
+import msgspec
+from cachetools import TTLCache
 import numpy as np
-from fastapi import FastAPI, Header, HTTPException, Depends
+import orjson
+from fastapi import FastAPI, Header, HTTPException, Depends, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import HTMLResponse
+from fastapi.responses import HTMLResponse, JSONResponse, Response
 from pydantic import BaseModel
-from sqlalchemy.orm import Session
-from sqlalchemy import func
-from database import SessionLocal, engine, Base
-from models import TradeLogDB, TelemetryDB
-from datetime import datetime, timedelta
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import func, select, insert
+from sqlalchemy.dialects.postgresql import aggregate_order_by
+from sqlalchemy.exc import SQLAlchemyError
+from database import AsyncSessionLocal, engine
+from models import TelemetryDB, ApiKeyDB
+from init_db import create_schema
+from datetime import datetime, timezone
+from typing import Annotated
 import hashlib
-from models import ApiKeyDB
+
+try:
+    from numba import njit
+    HAVE_NUMBA = True
+except ImportError:  # Kernels still run (as plain Python) without numba
+    HAVE_NUMBA = False
+
+try:
+    # Ahead-of-time build of both kernels (python build_kernels_aot.py); with
+    # it nothing is JIT-compiled at import, e.g. where numba's cache dir isn't
+    # writable or a serverless cold start can't afford the compile.
+    import kernels_aot
+except ImportError:
+    kernels_aot = None
+
+
+def kernel(fn):
+    """
+    JIT-compile fn with numba, caching the machine code on disk when numba
+    can find somewhere writable for it. Left as plain Python when the AOT
+    build supplies the kernels or numba isn't installed.
+    """
+    if kernels_aot is not None or not HAVE_NUMBA:
+        return fn
+    try:
+        return njit(cache=True, fastmath=True)(fn)
+    except RuntimeError:
+        # No cache locator (read-only source dir and user cache dir):
+        # compile once per process instead of failing the import
+        return njit(fastmath=True)(fn)
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger("uvicorn")
 
-Base.metadata.create_all(bind=engine)
-app = FastAPI()
+
+class OrjsonResponse(JSONResponse):
+    """JSON responses rendered by orjson (FastAPI's ORJSONResponse is deprecated)."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup()
+    yield
+    await flush_pending_telemetry()
+
+
+app = FastAPI(default_response_class=OrjsonResponse, lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,6 +90,19 @@ app.add_middleware(
 # --- QUANT FUNCTIONS ---
 
 
+# max_lag -> (centered log(2..max_lag-1), its sum of squares). max_lag is
+# min(20, n//2), so there are only ~10 distinct entries.
+_LOG_LAGS = {}
+
+
+def _log_lags(max_lag):
+    if max_lag not in _LOG_LAGS:
+        xs = np.log(np.arange(2, max_lag))
+        xc = xs - xs.mean()
+        _LOG_LAGS[max_lag] = (xc, (xc * xc).sum())
+    return _LOG_LAGS[max_lag]
+
+
 def calculate_hurst(ts):
     """
     Estimates Hurst Exponent (H) for a time series.
@@ -38,18 +110,302 @@ def calculate_hurst(ts):
     H ~ 0.5: Random Walk
     H > 0.5: Persistent (Trend/Dangerous behavior in latency)
     """
-    if len(ts) < 20:
+    arr = np.asarray(ts, dtype=np.float64)
+    if arr.shape[0] < 20:
         return 0.5  # Not enough data
 
-    lags = range(2, min(20, len(ts)//2))
-    tau = [np.std(np.subtract(ts[lag:], ts[:-lag])) for lag in lags]
+    if kernels_aot is not None:
+        return kernels_aot.hurst(arr)
+    if HAVE_NUMBA:
+        return float(hurst_kernel(arr))
+    return _hurst_numpy(arr)
 
-    # Avoid log(0) errors
-    tau = [t if t > 0 else 1e-6 for t in tau]
+
+@kernel
+def hurst_kernel(arr):
+    """
+    Compiled Hurst estimate for a float64 series of at least 20 points.
+    Each lag's std is a single fused Welford pass over arr[k:] - arr[:-k];
+    the log-log slope is accumulated from running sums as we go.
+    """
+    n = arr.shape[0]
+    max_lag = min(20, n // 2)
+    sum_x = 0.0
+    sum_y = 0.0
+    sum_xx = 0.0
+    sum_xy = 0.0
+    m = 0
+
+    for k in range(2, max_lag):
+        mean = 0.0
+        m2 = 0.0
+        for i in range(n - k):
+            d = arr[i + k] - arr[i]
+            delta = d - mean
+            mean += delta / (i + 1)
+            m2 += delta * (d - mean)
+
+        tau = math.sqrt(m2 / (n - k))
+        if tau <= 0:
+            tau = 1e-6  # Avoid log(0) errors
+
+        x = math.log(k)
+        y = math.log(tau)
+        sum_x += x
+        sum_y += y
+        sum_xx += x * x
+        sum_xy += x * y
+        m += 1
 
     # Slope of log-log plot
-    poly = np.polyfit(np.log(lags), np.log(tau), 1)
-    return poly[0] * 2.0  # H approximation
+    slope = (m * sum_xy - sum_x * sum_y) / (m * sum_xx - sum_x * sum_x)
+    return slope * 2.0  # H approximation
+
+
+def _hurst_numpy(arr):
+    # Vectorized fallback for hurst_kernel when numba isn't installed
+    n = arr.shape[0]
+    max_lag = min(20, n//2)
+    lags = np.arange(2, max_lag)
+    counts = n - lags
+
+    # Row k holds arr[i + lag_k] - arr[i]; cells past the end are masked out,
+    # so every lag's std comes out of the same handful of 2-D ufunc calls.
+    idx = np.arange(n - 2)
+    valid = idx < counts[:, None]
+    diffs = arr[np.minimum(idx + lags[:, None], n - 1)] - arr[idx]
+    diffs = np.where(valid, diffs, 0.0)
+    mean = diffs.sum(axis=1) / counts
+    dev = np.where(valid, diffs - mean[:, None], 0.0)
+    tau = np.sqrt((dev * dev).sum(axis=1) / counts)
+
+    # Avoid log(0) errors
+    tau = np.where(tau > 0, tau, 1e-6)
+
+    # Slope of log-log plot (closed-form least squares, no polyfit/SVD).
+    # xc sums to zero, so y needs no centering.
+    xc, sxx = _log_lags(max_lag)
+    slope = (xc * np.log(tau)).sum() / sxx
+    return float(slope * 2.0)  # H approximation
+
+
+def percentile_99(arr):
+    """
+    P99 with the same linear interpolation as np.percentile (and Postgres'
+    percentile_cont), but via O(n) selection of the two neighbouring order
+    statistics instead of a full sort.
+    """
+    pos = 0.99 * (arr.shape[0] - 1)
+    lo = int(pos)
+    frac = pos - lo
+    if frac == 0:
+        return float(np.partition(arr, lo)[lo])
+
+    part = np.partition(arr, (lo, lo + 1))
+    return float(part[lo] + (part[lo + 1] - part[lo]) * frac)
+
+
+def stats_fused(arr):
+    """Mean, population std and P99 of a latency series in one go."""
+    arr = np.asarray(arr, dtype=np.float64)
+    mu = arr.mean()
+    dev = arr - mu
+    return float(mu), math.sqrt((dev * dev).mean()), percentile_99(arr)
+
+
+# Heatmap buckets: < 50ms safe, < 150 warn, < 500 danger, else fatal
+HEAT_THRESHOLDS_MS = np.array([50, 150, 500])
+HEATMAP_POINTS = 30
+
+
+def pack_heat_codes(lats):
+    """
+    Bucket each latency into a 2-bit heat code (0..3) and pack four codes
+    per byte, lowest bits first, as base64. The dashboard only needs the
+    colour of each heatmap cell, not the raw milliseconds.
+    """
+    codes = np.searchsorted(HEAT_THRESHOLDS_MS, lats, side="right").astype(np.uint8)
+    codes = np.pad(codes, (0, -len(codes) % 4)).reshape(-1, 4)
+    packed = codes[:, 0] | codes[:, 1] << 2 | codes[:, 2] << 4 | codes[:, 3] << 6
+    return base64.b64encode(packed.tobytes()).decode()
+
+
+# Risk flag bits returned by score_brokers
+FLAG_HIGH_HURST = 1
+FLAG_FAT_TAIL = 2
+RISK_FLAG_LABELS = (
+    (FLAG_HIGH_HURST, "Unstable (High Hurst)"),
+    (FLAG_FAT_TAIL, "Fat Tail Risk"),
+)
+
+
+@kernel
+def score_brokers(avg, jitter, p99, hurst, high_urgency):
+    """
+    Routing score per broker (lower is better) plus a risk flag bitmask.
+    Takes one float64 array per metric (SoA) so it compiles in nopython mode.
+    """
+    n = avg.shape[0]
+    scores = np.empty(n)
+    flags = np.zeros(n, dtype=np.int64)
+
+    for i in range(n):
+        score = avg[i] + (jitter[i] * 2)
+
+        # A. Non-Ergodic Penalty (Hurst > 0.5 means "Cluster Risk")
+        if hurst[i] > 0.6:
+            score += 200
+            flags[i] |= FLAG_HIGH_HURST
+
+        # B. Fat Tail Penalty
+        if p99[i] > (avg[i] * 3):
+            score += 100
+            flags[i] |= FLAG_FAT_TAIL
+
+        # C. Urgency Logic
+        # If urgency is HIGH, we forgive Jitter but punish pure Latency
+        if high_urgency:
+            score = avg[i]  # Pure speed
+
+        scores[i] = score
+
+    return scores, flags
+
+
+if kernels_aot is not None:
+    rank_brokers = kernels_aot.score_brokers
+else:
+    # Pay the JIT compile (or cache load) at import, not on the first request
+    rank_brokers = score_brokers
+    _warm = np.zeros(4)
+    rank_brokers(_warm, _warm, _warm, _warm, False)
+    calculate_hurst(np.arange(40, dtype=np.float64))
+
+
+LIVE_WINDOW_S = 120  # last 2 minutes is enough for "Live" view
+WINDOW_BUCKET_S = 5
+
+
+def live_window_start():
+    """
+    Start of the live window, snapped down to a 5s bucket. Every request in
+    the same bucket sends the same bound value, so plans and results can be
+    reused instead of differing by a few microseconds each call.
+    """
+    bucket = int(time.time()) // WINDOW_BUCKET_S * WINDOW_BUCKET_S
+    # Naive UTC, like the stored timestamps (utcfromtimestamp is deprecated)
+    return datetime.fromtimestamp(bucket - LIVE_WINDOW_S, timezone.utc).replace(tzinfo=None)
+
+
+async def fetch_broker_stats(db: AsyncSession, since):
+    """
+    Per-broker latency aggregates for every ping since `since`, in one
+    grouped query (one row per broker instead of one per ping).
+    Postgres computes avg / stddev / P99 itself and ships the ordered
+    series as an array. SQLite has no percentile_cont or stddev, so it
+    only does the grouping and the spread metrics are finished in NumPy.
+    """
+    lat = TelemetryDB.latency_ms
+    window = (TelemetryDB.timestamp >= since, lat.isnot(None))
+
+    if engine.dialect.name == "postgresql":
+        result = await db.execute(select(
+            TelemetryDB.broker,
+            func.count(lat),
+            func.avg(lat),
+            func.stddev_pop(lat),
+            func.percentile_cont(0.99).within_group(lat.asc()),
+            func.array_agg(aggregate_order_by(lat, TelemetryDB.timestamp.asc())),
+        ).where(*window).group_by(TelemetryDB.broker))
+
+        return [{
+            "broker": broker,
+            "count": count,
+            "avg": float(avg),
+            "jitter": float(jitter),
+            "p99": float(p99),
+            "lats": np.fromiter(lats, dtype=np.int32, count=len(lats)),
+        } for broker, count, avg, jitter, p99, lats in result]
+
+    # SQLite fallback: group_concat keeps the subquery's timestamp order
+    ordered = select(TelemetryDB.broker, lat).where(
+        *window).order_by(TelemetryDB.timestamp).subquery()
+    result = await db.execute(select(
+        ordered.c.broker,
+        func.group_concat(ordered.c.latency_ms),
+    ).group_by(ordered.c.broker))
+
+    stats = []
+    for broker, joined in result:
+        # Parse the series straight into an int32 array (one C pass, no
+        # per-value Python ints) and run the spread metrics on it.
+        lats = np.fromstring(joined, dtype=np.int32, sep=",")
+        avg, jitter, p99 = stats_fused(lats)
+        stats.append({
+            "broker": broker,
+            "count": lats.shape[0],
+            "avg": avg,
+            "jitter": jitter,
+            "p99": p99,
+            "lats": lats,
+        })
+    return stats
+
+
+# --- LIVE STORE (In-Memory Ring Buffers) ---
+# Opt-in with LIVE_STATS_IN_MEMORY=1: the status/route reads then come from
+# per-broker buffers fed by /v1/telemetry and never touch the DB. Only valid
+# when ONE process receives all telemetry (single uvicorn worker); with more
+# workers, or on serverless, each instance would only see its own pings.
+LIVE_STATS_IN_MEMORY = os.getenv("LIVE_STATS_IN_MEMORY") == "1"
+LIVE_MAXLEN = 200
+LIVE = defaultdict(lambda: deque(maxlen=LIVE_MAXLEN))  # broker -> (timestamp, latency_ms)
+
+
+def record_live(broker, timestamp, latency_ms):
+    LIVE[broker].append((timestamp, latency_ms))
+
+
+def live_broker_stats(since):
+    """Same shape as fetch_broker_stats, over the last LIVE_MAXLEN pings per broker."""
+    stats = []
+    for broker, pings in list(LIVE.items()):
+        while pings and pings[0][0] < since:
+            pings.popleft()  # aged out of the window
+        if not pings:
+            # Brokers are whatever /v1/telemetry was sent: forget idle ones
+            # so the store doesn't keep growing
+            del LIVE[broker]
+            continue
+
+        lats = np.fromiter((lat for _, lat in pings), dtype=np.int32, count=len(pings))
+        avg, jitter, p99 = stats_fused(lats)
+        stats.append({
+            "broker": broker,
+            "count": lats.shape[0],
+            "avg": avg,
+            "jitter": jitter,
+            "p99": p99,
+            "lats": lats,
+        })
+    return stats
+
+
+async def seed_live_store(db: AsyncSession):
+    # Cold start: rebuild the buffers from the current window in the DB
+    result = await db.execute(select(
+        TelemetryDB.broker, TelemetryDB.timestamp, TelemetryDB.latency_ms,
+    ).where(
+        TelemetryDB.timestamp >= live_window_start(), TelemetryDB.latency_ms.isnot(None),
+    ).order_by(TelemetryDB.timestamp))
+    for broker, timestamp, latency_ms in result:
+        record_live(broker, timestamp, latency_ms)
+
+
+async def broker_stats(db: AsyncSession, since):
+    if LIVE_STATS_IN_MEMORY:
+        return live_broker_stats(since)
+    return await fetch_broker_stats(db, since)
 
 
 # --- DASHBOARD HTML (With Heatmap & Math) ---
@@ -133,6 +489,15 @@ DASHBOARD_HTML = """
         });
 
         // --- 2. EXISTING DASHBOARD LOGIC ---
+        // Heatmap cells arrive as 2-bit codes, four per byte (see pack_heat_codes)
+        const HEAT_CLASSES = ['bg-safe', 'bg-warn', 'bg-danger', 'bg-fatal'];
+        function decodeHeat(b64, n) {
+            const bytes = Uint8Array.from(atob(b64), c => c.charCodeAt(0));
+            const codes = new Array(n);
+            for (let i = 0; i < n; i++) codes[i] = (bytes[i >> 2] >> ((i & 3) * 2)) & 3;
+            return codes;
+        }
+
         function getHurstLabel(h) {
             if(h > 0.6) return {text: "PERSISTENT (RISK)", color: "text-red-400", border: "border-red-900"};
             if(h < 0.4) return {text: "MEAN REVERTING", color: "text-green-400", border: "border-green-900"};
@@ -144,9 +509,9 @@ DASHBOARD_HTML = """
                 const res = await fetch('/v1/global_status');
                 const data = await res.json();
                 
-                // Update Heatmap
+                // Update Heatmap (built off-DOM, swapped in once)
                 const heatmap = document.getElementById('heatmapGrid');
-                heatmap.innerHTML = '';
+                const heatmapRows = document.createDocumentFragment();
                 
                 data.forEach(broker => {
                     const row = document.createElement('div');
@@ -159,24 +524,23 @@ DASHBOARD_HTML = """
                     const cellsContainer = document.createElement('div');
                     cellsContainer.className = 'flex-1 flex';
                     
-                    broker.history.slice(-40).forEach(lat => {
+                    // Guard: a snapshot cached from before "heat" existed has none
+                    const codes = broker.heat ? decodeHeat(broker.heat, broker.heat_len) : [];
+                    codes.forEach(code => {
                         const cell = document.createElement('div');
-                        cell.className = 'h-cell transition-all';
-                        if(lat < 50) cell.classList.add('bg-safe');
-                        else if(lat < 150) cell.classList.add('bg-warn');
-                        else if(lat < 500) cell.classList.add('bg-danger');
-                        else cell.classList.add('bg-fatal');
+                        cell.className = 'h-cell transition-all ' + HEAT_CLASSES[code];
                         cellsContainer.appendChild(cell);
                     });
                     
                     row.appendChild(label);
                     row.appendChild(cellsContainer);
-                    heatmap.appendChild(row);
+                    heatmapRows.appendChild(row);
                 });
+                heatmap.replaceChildren(heatmapRows);
 
-                // Update Risk Cards
+                // Update Risk Cards (one innerHTML parse, not one per card)
                 const cards = document.getElementById('riskCards');
-                cards.innerHTML = '';
+                let cardsHtml = '';
                 
                 data.forEach(b => {
                     const hurstInfo = getHurstLabel(b.hurst);
@@ -207,8 +571,9 @@ DASHBOARD_HTML = """
                             </div>
                         </div>
                     </div>`;
-                    cards.innerHTML += html;
+                    cardsHtml += html;
                 });
+                cards.innerHTML = cardsHtml;
 
             } catch(e) { console.error(e); }
         }
@@ -219,37 +584,107 @@ DASHBOARD_HTML = """
 </body>
 </html>
 """
+
+# The page never changes at runtime: compress it once at import and let
+# clients revalidate with the ETag instead of re-downloading it.
+DASHBOARD_BYTES = DASHBOARD_HTML.encode()
+DASHBOARD_BR = brotli.compress(DASHBOARD_BYTES, quality=11)
+DASHBOARD_GZ = gzip.compress(DASHBOARD_BYTES, compresslevel=9)
+_DASHBOARD_HASH = hashlib.md5(DASHBOARD_BYTES).hexdigest()
+# Each encoding is its own representation, so each gets its own validator
+DASHBOARD_VARIANTS = {
+    "br": (DASHBOARD_BR, f'"{_DASHBOARD_HASH}-br"'),
+    "gzip": (DASHBOARD_GZ, f'"{_DASHBOARD_HASH}-gz"'),
+    None: (DASHBOARD_BYTES, f'"{_DASHBOARD_HASH}"'),
+}
+
+
+def accepted_encodings(header):
+    """Codings listed in Accept-Encoding, minus any refused with q=0."""
+    accepted = set()
+    for part in header.split(","):
+        coding, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding and q > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Weak comparison of an If-None-Match list against etag (RFC 9110 13.1.2):
+    W/ prefixes are ignored, so ETags a proxy has weakened still match.
+    """
+    if if_none_match.strip() == "*":
+        return True
+    tags = (t.strip() for t in if_none_match.split(","))
+    return any(t.removeprefix("W/") == etag for t in tags)
+
+
+def dashboard_response(request: Request):
+    accepted = accepted_encodings(request.headers.get("accept-encoding", ""))
+    encoding = next((e for e in ("br", "gzip") if e in accepted), None)
+    body, etag = DASHBOARD_VARIANTS[encoding]
+
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=300",
+        "Vary": "Accept-Encoding",
+    }
+    if etag_matches(request.headers.get("if-none-match", ""), etag):
+        return Response(status_code=304, headers=headers)
+
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="text/html", headers=headers)
+
 # --- DEPENDENCIES ---
 
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-async def verify_key(x_pro_key: str = Header(None), db: Session = Depends(get_db)):
+# key_hash -> (user_id, is_active). Entries expire after 30s so revocations
+# made with the admin tooling apply within 30s without a restart
+# (/v1/keys/invalidate evicts sooner, but only in the worker it reaches).
+API_KEY_CACHE = TTLCache(maxsize=10_000, ttl=30)
+
+
+async def verify_key(x_pro_key: str = Header(None), db: AsyncSession = Depends(get_db)):
     if not x_pro_key or not x_pro_key.startswith("sk_"):
         raise HTTPException(
             status_code=401, detail="Missing or Invalid API Key Format")
 
-    # 1. Hash the incoming key
+    # 1. Hash the incoming key (hashlib dispatches to OpenSSL / SHA-NI)
     incoming_hash = hashlib.sha256(x_pro_key.encode()).hexdigest()
 
-    # 2. Check DB for existence
-    key_record = db.query(ApiKeyDB).filter(
-        ApiKeyDB.key_hash == incoming_hash).first()
+    # 2. Look it up in memory, falling back to the DB on a miss/expiry
+    entry = API_KEY_CACHE.get(incoming_hash)
+    if entry is None:
+        result = await db.execute(select(ApiKeyDB.user_id, ApiKeyDB.is_active).where(
+            ApiKeyDB.key_hash == incoming_hash))
+        row = result.first()
+        if row:
+            entry = API_KEY_CACHE[incoming_hash] = (row.user_id, row.is_active)
 
-    if not key_record:
+    if not entry:
         raise HTTPException(status_code=403, detail="Invalid API Key")
 
-    if not key_record.is_active:
+    user_id, is_active = entry
+    if not is_active:
         raise HTTPException(status_code=403, detail="API Key Revoked")
 
     # Return the real User ID linked to this key
-    return key_record.user_id
+    return user_id
 
 # --- MODELS ---
 
@@ -264,83 +699,284 @@ class TradeLog(BaseModel):
     status: str
 
 
-class TelemetryPayload(BaseModel):
+# Pings are written in batches, so a value the column can't hold would fail
+# every row flushed with it: reject it here with a 422 instead.
+LatencyMs = Annotated[int, msgspec.Meta(ge=0, le=2**31 - 1)]
+
+
+class TelemetryPayload(msgspec.Struct):
     broker: str
-    latency_ms: int
+    latency_ms: LatencyMs
     slippage: float
     status: str
 
+
+# Hot path: decode + validate the tiny ping in one C pass instead of going
+# through pydantic. strict=False keeps pydantic's lax coercions ("12" -> 12).
+_telemetry_decoder = msgspec.json.Decoder(TelemetryPayload, strict=False)
+
+
+async def parse_telemetry(request: Request) -> TelemetryPayload:
+    try:
+        return _telemetry_decoder.decode(await request.body())
+    except msgspec.DecodeError as e:  # also covers ValidationError
+        raise HTTPException(status_code=422, detail=str(e))
+
+# --- TELEMETRY INGEST (Batched Writes) ---
+# Opt-in with TELEMETRY_BATCHING=1: pings are fire-and-forget analytics, so the
+# endpoint only enqueues them and a background task writes them in batches
+# (one commit covers hundreds of rows). Only for a long-lived process: on
+# serverless the queue is frozen between invocations and lost when the
+# instance is recycled, so by default each ping is inserted before replying.
+TELEMETRY_BATCHING = os.getenv("TELEMETRY_BATCHING") == "1"
+TELEMETRY_QUEUE_MAX = 10_000
+FLUSH_MAX_ROWS = 500
+FLUSH_INTERVAL_S = 0.25
+TELEMETRY_COLUMNS = ("broker", "latency_ms", "slippage", "status", "timestamp")
+# What a failed DB round trip can raise: ORM errors, raw asyncpg errors,
+# and socket errors while (re)connecting
+DB_ERRORS = (SQLAlchemyError, asyncpg.PostgresError,
+             asyncpg.InterfaceError, OSError)
+
+
+async def write_telemetry(rows):
+    if engine.dialect.name == "postgresql":
+        # COPY is the cheapest bulk path asyncpg offers
+        async with engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            await raw.driver_connection.copy_records_to_table(
+                TelemetryDB.__tablename__,
+                records=[tuple(r[c] for c in TELEMETRY_COLUMNS) for r in rows],
+                columns=TELEMETRY_COLUMNS,
+            )
+    else:
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(insert(TelemetryDB), rows)  # executemany
+                await db.commit()
+            except SQLAlchemyError:
+                await db.rollback()  # hand the connection back clean
+                raise
+
+
+def drain_telemetry(batch):
+    queue = app.state.telemetry_queue
+    while len(batch) < FLUSH_MAX_ROWS and not queue.empty():
+        batch.append(queue.get_nowait())
+    return batch
+
+
+async def flush_batch(batch):
+    try:
+        await write_telemetry(batch)
+    except Exception:
+        # Whatever went wrong (DB outage, a value the driver rejects), only
+        # this batch is lost: the flusher has to outlive it or the queue
+        # fills and every later ping gets a 503.
+        logger.exception("Telemetry flush failed, dropped %d pings", len(batch))
+
+
+async def telemetry_flusher():
+    queue = app.state.telemetry_queue
+    while True:
+        batch = [await queue.get()]
+        try:
+            # Give the batch time to fill unless there's already a full one waiting
+            if queue.qsize() < FLUSH_MAX_ROWS - 1:
+                await asyncio.sleep(FLUSH_INTERVAL_S)
+        finally:
+            # The batch is already off the queue, so it is written even when
+            # shutdown cancels us mid-wait. The write is shielded so a cancel
+            # can't abort it halfway; we wait it out before exiting.
+            drain_telemetry(batch)
+            write = asyncio.ensure_future(flush_batch(batch))
+            try:
+                await asyncio.shield(write)
+            except asyncio.CancelledError:
+                await write
+                raise
+
 # --- ENDPOINTS ---
 
 
+async def startup():
+    # Schema DDL is a deploy step (init_db.py); only the local SQLite
+    # fallback creates it on boot unless APP_INIT_DB=1 asks for it.
+    if os.getenv("APP_INIT_DB") == "1" or engine.dialect.name == "sqlite":
+        await create_schema()
+
+    if LIVE_STATS_IN_MEMORY:
+        async with AsyncSessionLocal() as db:
+            await seed_live_store(db)
+
+    # Queues and locks bind to the event loop that first uses them, so they
+    # are made per lifespan rather than at import
+    app.state.status_lock = asyncio.Lock()
+    if TELEMETRY_BATCHING:
+        app.state.telemetry_queue = asyncio.Queue(maxsize=TELEMETRY_QUEUE_MAX)
+        app.state.telemetry_flusher = asyncio.create_task(telemetry_flusher())
+
+
+async def flush_pending_telemetry():
+    if TELEMETRY_BATCHING:
+        # Cancelling the flusher still writes the batch it holds (see above)
+        flusher = app.state.telemetry_flusher
+        flusher.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await flusher
+
+        while not app.state.telemetry_queue.empty():
+            await flush_batch(drain_telemetry([]))
+
+    refresher = _status_cache["refresher"]
+    if refresher is not None:
+        # Let it finish the current pass rather than cancel mid-query. It only
+        # serves reads, so whatever it died of must not fail the shutdown.
+        _status_cache["last_hit"] = float("-inf")
+        try:
+            await refresher
+        except Exception:
+            logger.exception("Global status refresher failed")
+
+
 @app.get("/", response_class=HTMLResponse)
 # Set dashboard as ROOT for easy access
-async def root(): return DASHBOARD_HTML
+async def root(request: Request): return dashboard_response(request)
 
 
 @app.get("/dashboard", response_class=HTMLResponse)
-async def dashboard(): return DASHBOARD_HTML
+async def dashboard(request: Request): return dashboard_response(request)
 
 
 @app.post("/v1/telemetry")
-async def submit_telemetry(payload: TelemetryPayload, db: Session = Depends(get_db)):
-    try:
-        new_ping = TelemetryDB(
-            broker=payload.broker.lower(),
-            latency_ms=payload.latency_ms,
-            slippage=payload.slippage,
-            status=payload.status
-        )
-        db.add(new_ping)
-        db.commit()
-        return {"status": "ok"}
-    except:
-        return {"status": "error"}
+async def submit_telemetry(payload: TelemetryPayload = Depends(parse_telemetry),
+                           db: AsyncSession = Depends(get_db)):
+    row = {
+        "broker": payload.broker.lower(),
+        "latency_ms": payload.latency_ms,
+        "slippage": payload.slippage,
+        "status": payload.status,
+        "timestamp": datetime.utcnow(),
+    }
+    if TELEMETRY_BATCHING:
+        try:
+            app.state.telemetry_queue.put_nowait(row)
+        except asyncio.QueueFull:
+            # Flusher can't keep up with the DB; shed load instead of queueing forever
+            raise HTTPException(status_code=503, detail="Telemetry backlog full")
+    else:
+        try:
+            await db.execute(insert(TelemetryDB).values(**row))
+            await db.commit()
+        except DB_ERRORS:
+            await db.rollback()
+            logger.exception("Telemetry insert failed")
+            return {"status": "error"}
+
+    if LIVE_STATS_IN_MEMORY:
+        record_live(row["broker"], row["timestamp"], row["latency_ms"])
+    return {"status": "ok"}
+
+
+# Every open dashboard polls this endpoint. A background task recomputes the
+# serialized snapshot every second while anyone is polling, so the handler
+# only hands out bytes. It stops after a quiet spell, so an idle deploy
+# doesn't keep querying (and keep Neon awake).
+STATUS_REFRESH_S = 1.0
+STATUS_IDLE_STOP_S = 30.0
+# Public and identical for every viewer, so let the edge (Vercel CDN) absorb
+# most polls before they reach this process at all.
+STATUS_CACHE_HEADERS = {
+    "Cache-Control": "public, s-maxage=3, stale-while-revalidate=10",
+    "Vary": "Accept-Encoding",
+}
+# Older than this and the snapshot was left by a refresher that has since
+# stopped (or an instance that was frozen): don't hand it out.
+STATUS_MAX_AGE_S = 2 * STATUS_REFRESH_S
+_status_cache = {"body": None, "rendered_at": float("-inf"),
+                 "last_hit": 0.0, "refresher": None}
+
+
+async def _render_status():
+    async with AsyncSessionLocal() as db:
+        results = await compute_global_map(db)
+    _status_cache["body"] = orjson.dumps(
+        results, option=orjson.OPT_SERIALIZE_NUMPY)
+    _status_cache["rendered_at"] = time.monotonic()
+
+
+def _status_is_stale():
+    return time.monotonic() - _status_cache["rendered_at"] > STATUS_MAX_AGE_S
+
+
+async def status_refresher():
+    while time.monotonic() - _status_cache["last_hit"] < STATUS_IDLE_STOP_S:
+        try:
+            async with app.state.status_lock:
+                await _render_status()
+        except DB_ERRORS:
+            logger.exception("Global status refresh failed, serving last snapshot")
+        await asyncio.sleep(STATUS_REFRESH_S)
 
 
 @app.get("/v1/global_status")
-async def get_global_map(db: Session = Depends(get_db)):
-    # 1. Fetch recent data (last 2 minutes is enough for "Live" view)
-    since = datetime.utcnow() - timedelta(minutes=2)
-    raw = db.query(TelemetryDB).filter(TelemetryDB.timestamp >= since).all()
-
-    # 2. Group by Broker
-    data = {}
-    for r in raw:
-        if r.broker not in data:
-            data[r.broker] = []
-        data[r.broker].append(r.latency_ms)
-
-    # 3. Calculate Global Average (for Correlation)
-    all_latencies = [r.latency_ms for r in raw]
-    global_avg = statistics.mean(all_latencies) if all_latencies else 0
+async def get_global_map():
+    _status_cache["last_hit"] = time.monotonic()
+    refresher = _status_cache["refresher"]
+    if refresher is None or refresher.done():
+        _status_cache["refresher"] = asyncio.create_task(status_refresher())
+
+    if _status_is_stale():
+        # First poll since boot or since the refresher went idle: wait for
+        # (or produce) a fresh snapshot
+        async with app.state.status_lock:
+            if _status_is_stale():
+                try:
+                    await _render_status()
+                except DB_ERRORS:
+                    if _status_cache["body"] is None:
+                        raise
+                    logger.exception("Global status render failed, serving last snapshot")
+
+    return Response(content=_status_cache["body"], media_type="application/json",
+                    headers=STATUS_CACHE_HEADERS)
+
+
+async def compute_global_map(db: AsyncSession):
+    # 1. Aggregate recent data per broker
+    since = live_window_start()
+    stats = await broker_stats(db, since)
+
+    # 2. Global Average (for Correlation), weighted by ping count
+    total = sum(s["count"] for s in stats)
+    global_avg = sum(s["avg"] * s["count"] for s in stats) / total if total else 0
 
     results = []
-    for broker, lats in data.items():
-        if len(lats) < 5:
+    for s in stats:
+        if s["count"] < 5:
             continue
 
         # A. Hurst Exponent
-        hurst = calculate_hurst(lats)
-
-        # B. Risk Metrics
-        p99 = np.percentile(lats, 99)
-        jitter = np.std(lats)
+        hurst = calculate_hurst(s["lats"])
 
-        # C. "Systemic Correlation" (Simple Proxy)
+        # B. "Systemic Correlation" (Simple Proxy)
         # Does this broker deviate from the global average?
         # If correlation is high, they are systemic.
         # (Simplified to relative strength for performance)
-        avg = statistics.mean(lats)
-        correlation = min(1.0, avg / (global_avg + 1))
+        correlation = min(1.0, s["avg"] / (global_avg + 1))
 
         results.append({
-            "broker": broker,
-            "p99": int(p99),
-            "jitter": int(jitter),
+            "broker": s["broker"],
+            "p99": int(s["p99"]),
+            "jitter": int(s["jitter"]),
             "hurst": hurst,
             "correlation": correlation,
-            "history": lats[-30:]  # Send last 30 points for Heatmap
+            # Last 30 points for the Heatmap, as packed colour codes
+            "heat": pack_heat_codes(s["lats"][-HEATMAP_POINTS:]),
+            "heat_len": min(len(s["lats"]), HEATMAP_POINTS),
+            # Raw latencies, kept for one release only: dashboard tabs opened
+            # before "heat" shipped still run a script that reads them
+            "history": s["lats"][-HEATMAP_POINTS:],
         })
 
     return sorted(results, key=lambda x: x['p99'])
@@ -356,62 +992,35 @@ class RoutingRequest(BaseModel):
 
 
 @app.post("/v1/oracle/route")
-async def get_smart_route(req: RoutingRequest, user_id: str = Depends(verify_key), db: Session = Depends(get_db)):
+async def get_smart_route(req: RoutingRequest, user_id: str = Depends(verify_key), db: AsyncSession = Depends(get_db)):
     """
     The 'Waze' API: Tells the bot exactly where to route the trade.
     Monetization: Only available to Pro Users (valid API Key).
     """
-    # 1. Get Live Data (Last 2 minutes)
-    since = datetime.utcnow() - timedelta(minutes=2)
-    raw = db.query(TelemetryDB).filter(TelemetryDB.timestamp >= since).all()
-
-    # 2. Group & Analyze
-    candidates = {}
-    for r in raw:
-        if r.broker not in candidates:
-            candidates[r.broker] = []
-        candidates[r.broker].append(r.latency_ms)
-
-    scored_brokers = []
-
-    for broker, lats in candidates.items():
-        if len(lats) < 3:
-            continue  # Not enough data to trust
-
-        # Calculate Metrics
-        avg_lat = statistics.mean(lats)
-        jitter = np.std(lats)
-        hurst = calculate_hurst(lats)
-        p99 = np.percentile(lats, 99)
-
-        # 3. The Scoring Algorithm
-        # Lower score is better.
-        score = avg_lat + (jitter * 2)
-
-        # PENALTIES
-        risk_flags = []
-
-        # A. Non-Ergodic Penalty (Hurst > 0.5 means "Cluster Risk")
-        if hurst > 0.6:
-            score += 200
-            risk_flags.append("Unstable (High Hurst)")
-
-        # B. Fat Tail Penalty
-        if p99 > (avg_lat * 3):
-            score += 100
-            risk_flags.append("Fat Tail Risk")
-
-        # C. Urgency Logic
-        # If urgency is HIGH, we forgive Jitter but punish pure Latency
-        if req.urgency == "high":
-            score = avg_lat  # Pure speed
-
-        scored_brokers.append({
-            "broker": broker,
-            "score": int(score),
-            "latency_ms": int(avg_lat),
-            "risk_flags": risk_flags
-        })
+    # 1. Get Live Data (Last 2 minutes), aggregated per broker
+    since = live_window_start()
+    stats = await broker_stats(db, since)
+
+    # 2. Analyze
+    candidates = [s for s in stats if s["count"] >= 3]  # Not enough data to trust otherwise
+
+    # 3. The Scoring Algorithm (see score_brokers)
+    # Lower score is better.
+    avg_lat = np.array([s["avg"] for s in candidates])
+    scores, flags = rank_brokers(
+        avg_lat,
+        np.array([s["jitter"] for s in candidates]),
+        np.array([s["p99"] for s in candidates]),
+        np.array([calculate_hurst(s["lats"]) for s in candidates], dtype=np.float64),
+        req.urgency == "high",
+    )
+
+    scored_brokers = [{
+        "broker": s["broker"],
+        "score": int(score),
+        "latency_ms": int(avg),
+        "risk_flags": [label for bit, label in RISK_FLAG_LABELS if flag & bit]
+    } for s, score, avg, flag in zip(candidates, scores, avg_lat, flags)]
 
     # 4. Sort by Best Score
     scored_brokers.sort(key=lambda x: x['score'])
@@ -431,3 +1040,31 @@ async def get_smart_route(req: RoutingRequest, user_id: str = Depends(verify_key
         },
         "alternatives": scored_brokers[1:3]
     }
+
+# --- ADMIN HOOKS ---
+
+
+class KeyInvalidation(BaseModel):
+    # SHA-256 hex of the key; omit to drop the whole cache
+    key_hash: str | None = None
+
+
+@app.post("/v1/keys/invalidate")
+async def invalidate_api_key(body: KeyInvalidation, x_admin_token: str = Header(None)):
+    """
+    Evict a revoked key from the in-memory auth cache instead of waiting for
+    its TTL. Disabled unless ADMIN_TOKEN is set.
+    The cache is per process: this only clears the worker (or serverless
+    instance) that receives the call. Elsewhere the 30s TTL is the bound.
+    """
+    admin_token = os.getenv("ADMIN_TOKEN")
+    # compare_digest only takes ASCII str, so compare bytes (headers may be latin-1)
+    if not admin_token or not x_admin_token or not secrets.compare_digest(
+            x_admin_token.encode(), admin_token.encode()):
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    if body.key_hash:
+        API_KEY_CACHE.pop(body.key_hash, None)
+    else:
+        API_KEY_CACHE.clear()
+    return {"status": "ok"}
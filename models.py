@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean
+from sqlalchemy import Column, Integer, String, Float, DateTime, Boolean, Index, text
 from database import Base
 from datetime import datetime
 from sqlalchemy.sql import func
@@ -35,13 +35,55 @@ class TelemetryDB(Base):
     __tablename__ = "global_telemetry"
 
     id = Column(Integer, primary_key=True, index=True)
-    broker = Column(String, index=True)  # e.g. "binance", "alpaca"
+    broker = Column(String)  # e.g. "binance", "alpaca"
     latency_ms = Column(Integer)
     slippage = Column(Float)
     status = Column(String)             # "verified" or "anomaly"
     timestamp = Column(DateTime, default=datetime.utcnow)
 
 
+# 3. Hot-path Indexes
+# These get added to tables that are already taking writes, so on Postgres
+# they are built CONCURRENTLY (no write lock for the duration of the build).
+# That can't run inside a transaction: see init_db.create_schema.
+
+# Status/route queries range-scan the last few minutes of telemetry and group
+# by broker; on Postgres the latency/slippage columns ride along in the index
+# so the scan never touches the heap.
+Index("ix_telemetry_ts_broker", TelemetryDB.timestamp, TelemetryDB.broker,
+      postgresql_include=["latency_ms", "slippage"], postgresql_concurrently=True)
+
+# Per-broker, time-ordered access (and anything that used to filter on broker
+# alone; it replaces the old single-column broker index)
+Index("ix_telemetry_broker_ts", TelemetryDB.broker, TelemetryDB.timestamp,
+      postgresql_concurrently=True)
+
+# Per-user trade logs are read newest-first ("ORDER BY timestamp DESC LIMIT n")
+Index("ix_tradelog_user_ts", TradeLogDB.user_id, TradeLogDB.timestamp.desc(),
+      postgresql_concurrently=True)
+
+
+# Indexes made redundant by the composites above
+SUPERSEDED_INDEXES = ("ix_global_telemetry_broker",)
+
+
+def create_indexes(bind):
+    """
+    create_all() only builds indexes together with their table, so databases
+    created before an index was added never get it. Create any missing ones
+    and drop the ones they superseded. Expects an autocommit connection on
+    Postgres, where both run CONCURRENTLY.
+    """
+    for table in (TradeLogDB.__table__, TelemetryDB.__table__):
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+    drop = "DROP INDEX CONCURRENTLY IF EXISTS" if bind.dialect.name == "postgresql" \
+        else "DROP INDEX IF EXISTS"
+    for name in SUPERSEDED_INDEXES:
+        bind.execute(text(f"{drop} {name}"))
+
+
 class ApiKeyDB(Base):
     __tablename__ = "api_keys"
 
@@ -0,0 +1,73 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from database import engine
+
+
+def ping(client, broker, latency_ms=5):
+    return client.post("/v1/telemetry", json={
+        "broker": broker, "latency_ms": latency_ms, "slippage": 0.0, "status": "verified"})
+
+
+def stored_pings(broker):
+    with sqlite3.connect(engine.url.database) as conn:
+        return conn.execute(
+            "SELECT COUNT(*) FROM global_telemetry WHERE broker = ?", (broker,)).fetchone()[0]
+
+
+@pytest.fixture
+def batching(monkeypatch):
+    monkeypatch.setattr(main, "TELEMETRY_BATCHING", True)
+
+
+def test_shutdown_writes_every_queued_ping(batching):
+    # Includes the batch the flusher has already taken off the queue
+    with TestClient(main.app) as client:
+        for _ in range(10):
+            assert ping(client, "shutdown").status_code == 200
+
+    assert stored_pings("shutdown") == 10
+
+
+def test_full_queue_returns_503(batching, monkeypatch):
+    async def stalled_flusher():
+        await asyncio.Event().wait()
+
+    monkeypatch.setattr(main, "TELEMETRY_QUEUE_MAX", 2)
+    monkeypatch.setattr(main, "telemetry_flusher", stalled_flusher)
+
+    with TestClient(main.app) as client:
+        assert ping(client, "backlog").status_code == 200
+        assert ping(client, "backlog").status_code == 200
+        assert ping(client, "backlog").status_code == 503
+
+    # Shutdown still drains what was accepted
+    assert stored_pings("backlog") == 2
+
+
+def test_global_status_not_stale_after_idle_stop(monkeypatch):
+    monkeypatch.setattr(main, "STATUS_IDLE_STOP_S", 0.2)
+    monkeypatch.setattr(main, "STATUS_MAX_AGE_S", 0.5)
+
+    with TestClient(main.app) as client:
+        for _ in range(5):
+            ping(client, "idle-before")
+        brokers = [b["broker"] for b in client.get("/v1/global_status").json()]
+        assert "idle-before" in brokers
+
+        # Let the refresher go idle, then report a new broker
+        deadline = time.monotonic() + 5
+        while not main._status_cache["refresher"].done():
+            assert time.monotonic() < deadline
+            time.sleep(0.1)
+        time.sleep(0.6)
+        for _ in range(5):
+            ping(client, "idle-after")
+
+        brokers = [b["broker"] for b in client.get("/v1/global_status").json()]
+        assert "idle-after" in brokers